@@ -0,0 +1,341 @@
+__author__ = 'Harriet Turner'
+__email__ = 'h.turner3@pgr.reading.ac.uk'
+
+import os
+import re
+import json
+import shutil
+from math import ceil, log2
+from datetime import datetime, timedelta
+from Code import useful_functions as f
+
+
+# name of the file in the observations folder that keeps track of the days that could not be downloaded
+STATE_FILE = 'download_state.json'
+
+# patterns of the raw data file names, with the date of the data in the first group
+# DSCOVR file names are in the form oe_f1m_dscovr_sYYYYMMDDHHMMSS_..._pub.nc
+# STEREO-A file names are in the form STA_LB_PLA_BROWSE_YYYYMMDD_V14.cdf
+FILE_PATTERNS = {'DSCOVR': re.compile(r'oe_\w+_dscovr_s(\d{8})\d{6}_.*\.nc'),
+                 'STEREO-A': re.compile(r'STA_\w+_(\d{8})_V\d+\.cdf')}
+
+
+def file_date(spacecraft, file):
+
+    """
+    Function to find the date of the data in a raw data file from its file name.
+    :param spacecraft: 'DSCOVR' or 'STEREO-A'
+    :param file: file name
+    :return: date, str in the form YYYYMMDD, or None if the file is not a raw data file
+    """
+
+    match = FILE_PATTERNS[spacecraft].fullmatch(file)
+    if match is None:
+        return None
+
+    return match.group(1)
+
+
+def local_files(spacecraft, folder, remove_partial=True):
+
+    """
+    Function to list the raw data files already downloaded into a folder by the date of their data. Other files are
+    ignored, apart from zip files left by downloads that failed, which are removed if remove_partial is True.
+    :param spacecraft: 'DSCOVR' or 'STEREO-A'
+    :param folder: folder containing the raw data files
+    :param remove_partial: whether to remove the zip files left by downloads that failed, bool
+    :return: dictionary of lists of file names, with the dates as keys
+    """
+
+    files = dict()
+    if not os.path.exists(folder):
+        return files
+
+    for file in os.listdir(folder):
+        if file.endswith('.gz'):
+            if remove_partial:
+                os.remove(os.path.join(folder, file))
+            continue
+        date_str = file_date(spacecraft, file)
+        if date_str is not None:
+            files.setdefault(date_str, []).append(file)
+
+    return files
+
+
+def day_status(spacecraft, date, files, folder, settle=timedelta(hours=1)):
+
+    """
+    Function to find whether the data for a day has been downloaded. The data is stale if it may have changed since it
+    was downloaded: for DSCOVR if only the less processed fc1 product is available, and for STEREO-A if the file was
+    downloaded before the end of the day.
+    :param spacecraft: 'DSCOVR' or 'STEREO-A'
+    :param date: date of the data, datetime object
+    :param files: names of the files downloaded for that day
+    :param folder: folder containing the raw data files
+    :param settle: time after the end of the day before a file is taken to be complete, timedelta object
+    :return: 'missing', 'stale' or 'complete'
+    """
+
+    if len(files) == 0:
+        return 'missing'
+
+    if spacecraft == 'DSCOVR':
+        if any('f1m' in file for file in files):
+            return 'complete'
+        return 'stale'
+
+    # the STEREO-A beacon files are added to through the day, so they are only complete if downloaded afterwards
+    # the days are in UTC, so the download time is compared in UTC as well
+    day_end = datetime(date.year, date.month, date.day) + timedelta(days=1) + settle
+    downloaded = datetime.utcfromtimestamp(max(os.path.getmtime(os.path.join(folder, file)) for file in files))
+    if downloaded < day_end:
+        return 'stale'
+
+    return 'complete'
+
+
+def retry_delay(attempts, first_delay=timedelta(minutes=15), max_delay=timedelta(days=1)):
+
+    """
+    Function to find how long to wait before trying to download a day again, doubling after every failed attempt.
+    :param attempts: number of failed attempts, int
+    :param first_delay: wait after the first failed attempt, timedelta object
+    :param max_delay: longest wait, timedelta object
+    :return: wait, timedelta object
+    """
+
+    # the number of doublings is limited to the number needed to reach the longest wait, so it cannot overflow
+    doublings = min(attempts - 1, max(ceil(log2(max_delay / first_delay)), 0))
+
+    return min(first_delay * 2 ** doublings, max_delay)
+
+
+def load_state(obs_folder):
+
+    """
+    Function to read the record of failed downloads from the observations folder.
+    :param obs_folder: where the observations are saved
+    :return: dictionary of failed attempts for each spacecraft and date
+    """
+
+    path = os.path.join(obs_folder, STATE_FILE)
+    if not os.path.exists(path):
+        return dict()
+
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_state(obs_folder, state):
+
+    """
+    Function to save the record of failed downloads into the observations folder.
+    :param obs_folder: where the observations are saved
+    :param state: dictionary of failed attempts for each spacecraft and date
+    :return:
+    """
+
+    with open(os.path.join(obs_folder, STATE_FILE), 'w') as file:
+        json.dump(state, file, indent=1, sort_keys=True)
+
+
+def reuse_stored_days(spacecraft, dates, folder):
+
+    """
+    Function to link the days already downloaded into the other data window folders next to the given folder, so that
+    days downloaded for an earlier data window are not downloaded again. Complete days replace incomplete ones. The
+    files are hard linked where possible, so they do not take up any more disk space, and copied otherwise.
+    :param spacecraft: 'DSCOVR' or 'STEREO-A'
+    :param dates: dates of the data required, list of datetime objects
+    :param folder: folder the raw data files are saved in, inside the spacecraft raw data folder
+    :return:
+    """
+
+    folder = os.path.normpath(folder)
+    raw_folder = os.path.dirname(folder)
+    files = local_files(spacecraft, folder)
+
+    # listing the files in the other data window folders, newest data window first
+    stores = list()
+    for window_folder in sorted(os.listdir(raw_folder), reverse=True):
+        stored_folder = os.path.join(raw_folder, window_folder)
+        if stored_folder != folder and os.path.isdir(stored_folder):
+            stores.append((stored_folder, local_files(spacecraft, stored_folder, remove_partial=False)))
+
+    for date in dates:
+        date_str = f.date_string(date)
+        if day_status(spacecraft, date, files.get(date_str, []), folder) == 'complete':
+            continue
+
+        # looking through the other data window folders for a complete copy of the day, or if there are no files for
+        # the day in this folder, the newest incomplete copy, so that it is not downloaded again if it will not change
+        reuse = None
+        for stored_folder, stored_files in stores:
+            stored = stored_files.get(date_str, [])
+            if day_status(spacecraft, date, stored, stored_folder) == 'complete':
+                reuse = (stored_folder, stored)
+                break
+            if reuse is None and len(stored) > 0 and len(files.get(date_str, [])) == 0:
+                reuse = (stored_folder, stored)
+        if reuse is None:
+            continue
+
+        # replacing any incomplete files for the day, keeping the download time of the stored files
+        stored_folder, stored = reuse
+        for file in files.get(date_str, []):
+            os.remove(os.path.join(folder, file))
+        for file in stored:
+            try:
+                os.link(os.path.join(stored_folder, file), os.path.join(folder, file))
+            except OSError:
+                shutil.copy2(os.path.join(stored_folder, file), os.path.join(folder, file))
+
+
+def remove_old_windows(folder, keep_windows):
+
+    """
+    Function to remove the data window folders older than the given folder, keeping the most recent ones. Only folders
+    named with a date, YYYYMMDD, are removed.
+    :param folder: folder the raw data files are saved in, inside the spacecraft raw data folder
+    :param keep_windows: number of data window folders to keep, including the given folder, int
+    :return:
+    """
+
+    folder = os.path.normpath(folder)
+    raw_folder = os.path.dirname(folder)
+    window_folders = [window_folder for window_folder in os.listdir(raw_folder)
+                      if re.fullmatch(r'\d{8}', window_folder) and window_folder < os.path.basename(folder)]
+
+    for window_folder in sorted(window_folders, reverse=True)[max(keep_windows - 1, 0):]:
+        shutil.rmtree(os.path.join(raw_folder, window_folder))
+
+
+def plan_downloads(spacecraft, dates, folder, state, products, now=None):
+
+    """
+    Function to find the days that need to be downloaded, with the newest first so the most recent data arrives first,
+    and the data products to try for each. Days that have already been downloaded are skipped, as are products that
+    failed recently for a day and are waiting to be retried. For past DSCOVR days that already have the less processed
+    fc1 product, only the other products are tried, as the fc1 file will not change.
+    :param spacecraft: 'DSCOVR' or 'STEREO-A'
+    :param dates: dates of the data required, list of datetime objects
+    :param folder: folder containing the raw data files
+    :param state: dictionary of failed attempts for each spacecraft, date and product
+    :param products: data products to try in order
+    :param now: current time, datetime object. Defaults to the time now
+    :return: list of dates, their status, 'missing' or 'stale', and the products to try
+    """
+
+    now = datetime.now() if now is None else now
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    files = local_files(spacecraft, folder)
+    failures = state.get(spacecraft, dict())
+
+    plan = list()
+    for date in sorted(dates, reverse=True):
+        date_str = f.date_string(date)
+        day_files = files.get(date_str, [])
+        status = day_status(spacecraft, date, day_files, folder)
+        if status == 'complete':
+            continue
+
+        # skipping the products that are waiting to be retried, and the ones already downloaded for past days
+        day_products = list()
+        for product in products:
+            failure = failures.get(date_str, dict()).get(product)
+            if failure is not None and datetime.fromisoformat(failure['next_attempt']) > now:
+                continue
+            if date < today and any(product in file for file in day_files):
+                continue
+            day_products.append(product)
+
+        if len(day_products) > 0:
+            plan.append((date, status, day_products))
+
+    return plan
+
+
+def run_plan(spacecraft, dates, folder, obs_folder, downloader, products=('data',), keep_windows=None):
+
+    """
+    Function to download the days that are missing or stale, newest first, and keep track of the products that fail
+    for each day so that they are retried later, waiting longer after each failure.
+    :param spacecraft: 'DSCOVR' or 'STEREO-A'
+    :param dates: dates of the data required, list of datetime objects
+    :param folder: folder the raw data files are saved in
+    :param obs_folder: where the observations are saved
+    :param downloader: function taking a data product, date and destination that downloads one day of data
+    :param products: data products to try in order, the first that downloads is kept
+    :param keep_windows: number of data window folders to keep, including this one, once the stored days have been
+    linked into this one, int. If None, the older data window folders are all kept
+    :return:
+    """
+
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    # using the days already downloaded for other data windows before downloading anything, and then removing the
+    # older data window folders that are no longer needed
+    reuse_stored_days(spacecraft, dates, folder)
+    if keep_windows is not None:
+        remove_old_windows(folder, keep_windows)
+
+    # removing the failures for days that are not in this data window
+    state = load_state(obs_folder)
+    failures = state.setdefault(spacecraft, dict())
+    date_strs = set(f.date_string(date) for date in dates)
+    for date_str in list(failures):
+        if date_str not in date_strs:
+            failures.pop(date_str)
+
+    # the failures are saved even if the downloads stop part way through
+    try:
+        run_downloads(spacecraft, folder, state, failures, downloader, products, dates)
+    finally:
+        save_state(obs_folder, state)
+
+
+def run_downloads(spacecraft, folder, state, failures, downloader, products, dates):
+
+    """
+    Function to download the days given by plan_downloads, recording the products that fail for each day.
+    :param spacecraft: 'DSCOVR' or 'STEREO-A'
+    :param folder: folder the raw data files are saved in
+    :param state: dictionary of failed attempts for each spacecraft, date and product
+    :param failures: dictionary of failed attempts for the spacecraft, by date and product
+    :param downloader: function taking a data product, date and destination that downloads one day of data
+    :param products: data products to try in order, the first that downloads is kept
+    :param dates: dates of the data required, list of datetime objects
+    :return:
+    """
+
+    for date, status, day_products in plan_downloads(spacecraft, dates, folder, state, products):
+        date_str = f.date_string(date)
+        before = local_files(spacecraft, folder).get(date_str, [])
+        day_failures = failures.setdefault(date_str, dict())
+
+        # trying each data product in turn, recording the failures and when to try each one again
+        downloaded = False
+        for product in day_products:
+            try:
+                downloader(product, date, folder)
+                downloaded = True
+                day_failures.pop(product, None)
+                break
+            except:
+                attempts = day_failures.get(product, dict()).get('attempts', 0) + 1
+                next_attempt = datetime.now() + retry_delay(attempts)
+                day_failures[product] = {'attempts': attempts, 'next_attempt': next_attempt.isoformat()}
+
+        if len(day_failures) == 0:
+            failures.pop(date_str)
+
+        if downloaded:
+            # removing the older files for the day if the new file has a different name, eg. f1m replacing fc1
+            after = local_files(spacecraft, folder).get(date_str, [])
+            if set(after) - set(before):
+                for file in before:
+                    os.remove(os.path.join(folder, file))
+        elif status == 'missing':
+            print('Data not available for', date)
@@ -8,6 +8,8 @@ import gzip
 import shutil
 import netCDF4 as nc
 from Code import useful_functions as f
+from Code import download_planner as planner
+from Code import profiling
 import numpy as np
 from timeit import default_timer as timer
 
@@ -48,7 +50,7 @@ def dscovr_rt_file_downloader(data_product, date, destination):
     # finds the directory that all the data files are in, as there are separate pages for each month
     parent_page = f.rt_directory_finder(date, master_page='https://www.ngdc.noaa.gov/dscovr/data/')
     # gets the url for the data
-    url = dscovr_rt_link_generator(f.webpage_links(parent_page), data_product, date)
+    url = dscovr_rt_link_generator(f.cached_webpage_links(parent_page), data_product, date)
     # downloads the data
     f.web_scraper(str(parent_page + '/' + url), os.path.join(destination, url))
 
@@ -122,13 +124,90 @@ def dscovr_netcdf_reader(file):
     return dscovr_time(data['time'][:].data), dscovr_sw_speed(-1 * (data['proton_vx_gse'][:].data))
 
 
-def dscovr_obs_download(start_date, end_date, obs_folder):
+def dscovr_netcdf_length(file):
+
+    """
+    Function to find the number of data points in a DSCOVR Net CDF file from the file metadata, without reading the
+    data.
+    :param file: path to the file, str
+    :return: number of data points, int
+    """
+
+    with nc.Dataset(file) as data:
+        return len(data.dimensions['time'])
+
+
+def dscovr_netcdf_read_into(file, times, speeds):
+
+    """
+    Function to read the DSCOVR data from a Net CDF file straight into arrays that have already been created, rather
+    than into new lists.
+    :param file: path to the file, str
+    :param times: array to fill with the times, in milliseconds since 1970-01-01 00:00:00
+    :param speeds: array to fill with the proton speeds, with unphysical values as NaNs
+    :return:
+    """
+
+    # testing to make sure the correct data product is being used
+    if 'fc0' in file:
+        raise ValueError("Does not work for this data product. Use fc1 or f1m instead.")
+
+    # reading the data from the file without masking it, so that no masked array copies are made
+    with nc.Dataset(file) as data:
+        data.set_auto_mask(False)
+        times[:] = data['time'][:]
+        speeds[:] = data['proton_vx_gse'][:]
+
+    # the speed is the negative of the x component of the velocity, changed in place
+    np.negative(speeds, out=speeds)
+
+    # turning the values that are unphysical into NaNs, one file at a time so the temporary arrays stay small
+    speeds[(speeds > 5000) | (speeds < 0)] = np.nan
+
+
+def dscovr_obs_read(start_date, directory, memory_map=False):
+
+    """
+    Function to read all the downloaded DSCOVR observations for a data window into single arrays. The arrays are
+    created at the full size from the file metadata and filled file by file.
+    :param start_date: date of the start of the data window being downloaded, datetime object
+    :param directory: location of the folder containing the observation files, str
+    :param memory_map: whether the arrays are memory-mapped to temporary files rather than held in memory, bool
+    :return: dates as a numpy datetime64 array and the solar wind speeds, with unphysical values as NaNs
+    """
+
+    # finding the folder for the given date and sorting the files so they are in chronological order
+    folder = os.path.join(directory, 'DSCOVR_raw', f.date_string(start_date))
+    files = [file for file in os.listdir(folder) if file.endswith('.nc')]
+    files.sort(key=f.dscovr_file_sort_key)
+
+    # finding the length of each file to create arrays large enough for all the data
+    paths = [os.path.join(folder, file) for file in files]
+    lengths = [dscovr_netcdf_length(path) for path in paths]
+    times = f.preallocate(sum(lengths), 'int64', memory_map)
+    sw_speed = f.preallocate(sum(lengths), 'float64', memory_map)
+
+    # reading each file into its section of the arrays
+    position = 0
+    for path, length in zip(paths, lengths):
+        dscovr_netcdf_read_into(path, times[position:position + length], sw_speed[position:position + length])
+        position += length
+
+    # the times are in milliseconds since 1970, so they can be viewed as dates without copying them
+    return times.view('datetime64[ms]'), sw_speed
+
+
+def dscovr_obs_download(start_date, end_date, obs_folder, planned=False, keep_windows=None):
 
     """
     Function to download DSCOVR real time data between two dates to feed into BRAvDA in the correct format.
     :param start_date: start of the interval for the data download
     :param end_date: end of the interval for the data download
     :param obs_folder: where the observations are saved
+    :param planned: whether to keep the files already downloaded and only download the missing or out of date days,
+    newest first, retrying failed days later
+    :param keep_windows: when planned, the number of data window folders to keep, including this one. If None, the
+    older data window folders are all kept
     :return:
     """
 
@@ -144,6 +223,12 @@ def dscovr_obs_download(start_date, end_date, obs_folder):
     else:
         os.mkdir(os.path.join(obs_folder, 'DSCOVR_raw'))
 
+    # downloads the days that are missing or only have the less processed data, keeping the rest of the folder
+    if planned:
+        planner.run_plan('DSCOVR', dates, os.path.join(obs_folder, 'DSCOVR_raw', date_str), obs_folder,
+                         dscovr_rt_file_downloader, products=('f1m', 'fc1'), keep_windows=keep_windows)
+        return
+
     # creates a folder for the data to be saved in, with the name YYYYMMDD of the given date
     # checks first to see if the folder exists, so it doesn't error by trying to make a new one
     if os.path.exists(os.path.join(obs_folder, 'DSCOVR_raw', date_str)) == True:
@@ -168,53 +253,72 @@ def dscovr_obs_download(start_date, end_date, obs_folder):
                 continue
 
 
-def dscovr_obs_format(start_date, directory):
+def dscovr_obs_format(start_date, directory, memory_map=False):
 
     """
     Function to take the downloaded observations and change them into a format that can be used by BRaVDA.
     :param start_date: date of the start of the data window being downloaded, datetime object
     :param directory: location of the folder containing the observation files, str
+    :param memory_map: whether to read the data into memory-mapped arrays and average them without copying, for
+    large data windows, bool
     :return:
     """
 
-    # transforming the given date into strings to find the correct folder
-    date_str = f.date_string(start_date)
-
-    # creates the file name from the string of the given date
-    folder = os.path.join(directory, 'DSCOVR_raw', date_str)
-    # lists all the files in the folder
-    files = os.listdir(folder)
-    # makes sure the files are sorted by their start date, so they are in chronological order
-    files.sort(key=f.dscovr_file_sort_key)
-
-    # empty lists to append the data to from each file
-    dates = []
-    sw_speed = []
-
-    # loops through the files in the folder and extracts the data
-    for file in files:
-        file_path = os.path.join(folder, file)
-        dates.append(dscovr_netcdf_reader(file_path)[0])
-        sw_speed.append(dscovr_netcdf_reader(file_path)[1])
-
-    # flattens the list of lists into a single list for the dates and solar wind speeds
-    dates = f.flatten_list(dates)
-    sw_speed = f.flatten_list(sw_speed)
-
-    # turning the values that are unphysical into NaNs
-    for i in range(0, len(sw_speed)):
-        if sw_speed[i] > 5000 or sw_speed[i] < 0:
-            sw_speed[i] = np.nan
-        else:
-            sw_speed[i] = sw_speed[i]
-
-    # puts the data into a pandas dataframe
-    df = pd.DataFrame()
-    df['Date'] = dates
-    df['Solar_wind_speed'] = sw_speed
-
-    # makes a list of hourly dates from the first and last dates in the dataframe
-    hourly_dates = f.date_list(dates[0], dates[-1], timedelta(hours=1))
+    if memory_map:
+        # reads the data straight into memory-mapped arrays and averages them to one hour resolution
+        dates, sw_speed = dscovr_obs_read(start_date, directory, memory_map=True)
+        hourly_dates = f.date_list(dates[0].item(), dates[-1].item(), timedelta(hours=1))
+        hourly_averaged_sw_speed = f.hourly_average(dates, sw_speed, hourly_dates)
+    else:
+        # transforming the given date into strings to find the correct folder
+        date_str = f.date_string(start_date)
+
+        # creates the file name from the string of the given date
+        folder = os.path.join(directory, 'DSCOVR_raw', date_str)
+        # lists all the files in the folder
+        # only the data files are used, in case there are any other files in the folder
+        files = [file for file in os.listdir(folder) if file.endswith('.nc')]
+        # makes sure the files are sorted by their start date, so they are in chronological order
+        files.sort(key=f.dscovr_file_sort_key)
+
+        # empty lists to append the data to from each file
+        dates = []
+        sw_speed = []
+
+        # loops through the files in the folder and extracts the data
+        for file in files:
+            file_path = os.path.join(folder, file)
+            dates.append(dscovr_netcdf_reader(file_path)[0])
+            sw_speed.append(dscovr_netcdf_reader(file_path)[1])
+
+        # flattens the list of lists into a single list for the dates and solar wind speeds
+        dates = f.flatten_list(dates)
+        sw_speed = f.flatten_list(sw_speed)
+
+        # turning the values that are unphysical into NaNs
+        for i in range(0, len(sw_speed)):
+            if sw_speed[i] > 5000 or sw_speed[i] < 0:
+                sw_speed[i] = np.nan
+            else:
+                sw_speed[i] = sw_speed[i]
+
+        # puts the data into a pandas dataframe
+        df = pd.DataFrame()
+        df['Date'] = dates
+        df['Solar_wind_speed'] = sw_speed
+
+        # makes a list of hourly dates from the first and last dates in the dataframe
+        hourly_dates = f.date_list(dates[0], dates[-1], timedelta(hours=1))
+
+        # empty lists to append the hourly averaged data to
+        hourly_averaged_sw_speed = []
+
+        # looping through the data to average it all to one hour resolution for use in BRaVDA
+        for i in range(0, len(hourly_dates)):
+            data_req = df.loc[(df['Date'] >= (hourly_dates[i] - timedelta(minutes=30))) &
+                              (df['Date'] < (hourly_dates[i] + timedelta(minutes=30)))]
+            average_speed = data_req['Solar_wind_speed'].mean()
+            hourly_averaged_sw_speed.append(average_speed)
 
     # creates lists of year, DOY and hour for the data that feeds into BRaVDA
     year = []
@@ -225,16 +329,6 @@ def dscovr_obs_format(start_date, directory):
         doy.append(f.date_to_doy(hourly_date)[1])
         hour.append(f.date_to_doy(hourly_date)[2])
 
-    # empty lists to append the hourly averaged data to
-    hourly_averaged_sw_speed = []
-
-    # looping through the data to average it all to one hour resolution for use in BRaVDA
-    for i in range(0, len(hourly_dates)):
-        data_req = df.loc[(df['Date'] >= (hourly_dates[i] - timedelta(minutes=30))) &
-                          (df['Date'] < (hourly_dates[i] + timedelta(minutes=30)))]
-        average_speed = data_req['Solar_wind_speed'].mean()
-        hourly_averaged_sw_speed.append(average_speed)
-
     # creates a dataframe of the hourly averaged data
     averaged_df = pd.DataFrame()
     averaged_df['Year'] = year
@@ -247,7 +341,7 @@ def dscovr_obs_format(start_date, directory):
                fmt=['%4.0d', '%4.0d', '%3.0d', '%6.0f'])
 
 
-def dscovr_real_time_obs(start_date, end_date, directory):
+def dscovr_real_time_obs(start_date, end_date, directory, memory_map=False, planned=False, profile=None):
 
     """
     Function that pulls together the parts to download and format the real time observations from DSCOVR to use in
@@ -255,17 +349,25 @@ def dscovr_real_time_obs(start_date, end_date, directory):
     :param start_date: start date of the observations required
     :param end_date: end date of the observations required
     :param directory: location where the data will be saved
+    :param memory_map: whether to format the data using memory-mapped arrays, for large data windows
+    :param planned: whether to only download the days that are missing or out of date, newest first
+    :param profile: folder to save profiles of each stage in. If None, profiling is only turned on by the
+    RT_DOWNLOAD_PROFILE environment variable
     :return:
     """
 
     # starting a timer to see how long the code takes
     timer_start = timer()
+    # finding where to save the profiles, if profiling is turned on
+    profile = profiling.start_profile(profile, 'dscovr')
 
     # using the function to download the observations
-    dscovr_obs_download(start_date, end_date, directory)
+    with profiling.profile_stage('dscovr_download', profile):
+        dscovr_obs_download(start_date, end_date, directory, planned)
 
     # using the function to format the observations that have just been downloaded
-    dscovr_obs_format(start_date, directory)
+    with profiling.profile_stage('dscovr_format', profile):
+        dscovr_obs_format(start_date, directory, memory_map)
 
     # stopping the timer and printing out the time it took for the code to run
     timer_end = timer()
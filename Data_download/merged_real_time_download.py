@@ -0,0 +1,104 @@
+__author__ = 'Harriet Turner'
+__email__ = 'h.turner3@pgr.reading.ac.uk'
+
+import os
+from datetime import timedelta
+import numpy as np
+from Code import useful_functions as f
+from Code import dscovr_real_time_download as dscovr
+from Code import stereoa_real_time_download as sta
+from Code import profiling
+from timeit import default_timer as timer
+
+
+# the spacecraft in the merged file, in column order, with the name of their BRaVDA observation file
+SPACECRAFT_FILES = (('DSCOVR', 'DSCOVR_rt_observations.txt'),
+                    ('STEREO-A', 'STEREO-A_rt_observations.txt'),
+                    ('STEREO-B', 'STEREO-B_rt_observations.txt'))
+
+
+def merged_obs_format(start_date, end_date, directory, cadence=timedelta(hours=1), memory_map=False):
+
+    """
+    Function to average the downloaded observations from all the spacecraft onto the same dates and save them in one
+    file, along with the separate files used by BRaVDA, so that all the files have the same length and dates. The
+    files used by BRaVDA are always hourly, whatever the cadence of the merged file.
+    :param start_date: start date of the data window, datetime object
+    :param end_date: end date of the data window, datetime object
+    :param directory: location of the folder containing the observations and where the files will be saved, str
+    :param cadence: gap between the dates in the merged file, timedelta object
+    :param memory_map: whether to read the data into memory-mapped arrays, for large data windows, bool
+    :return:
+    """
+
+    # the dates that all the spacecraft data are averaged onto, for the merged file and for BRaVDA
+    dates = f.date_list(start_date, end_date, cadence)
+    hourly_dates = f.date_list(start_date, end_date, timedelta(hours=1))
+
+    # averaging the data for each spacecraft onto the dates, using a window the width of the cadence
+    # the hourly averages are only worked out separately if the cadence is not hourly
+    # STEREO-B is no longer operational, so it has no data
+    speeds = dict()
+    hourly_speeds = dict()
+    for spacecraft, read in (('DSCOVR', dscovr.dscovr_obs_read), ('STEREO-A', sta.stereoa_obs_read)):
+        times, solar_wind_speed = read(start_date, directory, memory_map)
+        speeds[spacecraft] = f.hourly_average(times, solar_wind_speed, dates, window=cadence)
+        if cadence == timedelta(hours=1):
+            hourly_speeds[spacecraft] = speeds[spacecraft]
+        else:
+            hourly_speeds[spacecraft] = f.hourly_average(times, solar_wind_speed, hourly_dates)
+    speeds['STEREO-B'] = np.full(len(dates), np.nan)
+    hourly_speeds['STEREO-B'] = np.full(len(hourly_dates), np.nan)
+
+    # year, DOY, hour and minute of the dates, so that cadences shorter than an hour have unique dates
+    table = f.bravda_table(dates, np.nan)
+    minutes = np.array([date.minute for date in dates])
+
+    # saving all the spacecraft in one file, with a column for each
+    merged = np.column_stack([table[:, 0:3], minutes] + [speeds[spacecraft] for spacecraft, _ in SPACECRAFT_FILES])
+    np.savetxt(os.path.join(directory, 'merged_rt_observations.csv'), merged, delimiter=',',
+               fmt=['%d', '%d', '%d', '%d', '%.1f', '%.1f', '%.1f'], comments='',
+               header='Year,DOY,Hour,Minute,' + ','.join(spacecraft for spacecraft, _ in SPACECRAFT_FILES))
+
+    # saving each spacecraft in the hourly file used by BRaVDA, from the same dates
+    hourly_table = f.bravda_table(hourly_dates, np.nan)
+    for spacecraft, file_name in SPACECRAFT_FILES:
+        hourly_table[:, 3] = hourly_speeds[spacecraft]
+        np.savetxt(os.path.join(directory, file_name), hourly_table, fmt=['%4.0d', '%4.0d', '%3.0d', '%6.0f'])
+
+
+def merged_real_time_obs(start_date, end_date, directory, cadence=timedelta(hours=1), memory_map=False,
+                         planned=False, profile=None):
+
+    """
+    Function to download the real time observations from DSCOVR and STEREO-A and save them on the same dates to use
+    in BRaVDA.
+    :param start_date: start date of the observations required
+    :param end_date: end date of the observations required
+    :param directory: location where the data will be saved
+    :param cadence: gap between the dates in the saved files, timedelta object
+    :param memory_map: whether to format the data using memory-mapped arrays, for large data windows
+    :param planned: whether to only download the days that are missing or out of date, newest first
+    :param profile: folder to save profiles of each stage in. If None, profiling is only turned on by the
+    RT_DOWNLOAD_PROFILE environment variable
+    :return:
+    """
+
+    # starting a timer to see how long the code takes
+    timer_start = timer()
+    # finding where to save the profiles, if profiling is turned on
+    profile = profiling.start_profile(profile, 'merged')
+
+    # downloading the observations from each spacecraft
+    with profiling.profile_stage('dscovr_download', profile):
+        dscovr.dscovr_obs_download(start_date, end_date, directory, planned)
+    with profiling.profile_stage('stereoa_download', profile):
+        sta.stereoa_obs_download(start_date, end_date, directory, planned)
+
+    # formatting the observations onto the same dates
+    with profiling.profile_stage('merged_format', profile):
+        merged_obs_format(start_date, end_date, directory, cadence, memory_map)
+
+    # stopping the timer and printing out the time it took for the code to run
+    timer_end = timer()
+    print(timer_end - timer_start, 'seconds to download and format the merged data.')
@@ -0,0 +1,295 @@
+__author__ = 'Harriet Turner'
+__email__ = 'h.turner3@pgr.reading.ac.uk'
+
+import io
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+from Code import useful_functions as f
+from Code import dscovr_real_time_download as dscovr
+from Code import stereoa_real_time_download as sta
+from timeit import default_timer as timer
+
+
+# the spacecraft that observations can be requested for
+SPACECRAFT = ('dscovr', 'stereo-a', 'stereo-b')
+
+# the formats the observations can be returned in, with their content types
+FORMATS = {'bravda': 'text/plain', 'csv': 'text/csv', 'binary': 'application/octet-stream'}
+
+# the largest number of dates that can be requested at once
+MAX_DATES = 100000
+
+# the largest total number of dates kept in memory across all the cached averages
+MAX_CACHED_DATES = 200000
+
+
+class ObsCache:
+
+    """
+    Class to keep the most recent real time observations in memory, so that they can be averaged and returned without
+    downloading and formatting the data for every request.
+    """
+
+    def __init__(self, directory, window=timedelta(days=5), max_aggregates=128, max_dates=MAX_DATES,
+                 max_cached_dates=MAX_CACHED_DATES):
+
+        """
+        :param directory: location where the data will be downloaded to
+        :param window: length of the data window kept in memory, up to the end of the current day, timedelta object
+        :param max_aggregates: number of averaged data windows kept in memory
+        :param max_dates: largest number of dates that can be requested at once
+        :param max_cached_dates: largest total number of dates in the averaged data windows kept in memory
+        """
+
+        self.directory = directory
+        self.window = window
+        self.max_aggregates = max_aggregates
+        self.max_dates = max_dates
+        self.max_cached_dates = max_cached_dates
+        self.lock = threading.Lock()
+        # dates and solar wind speeds for each spacecraft, read from the raw files
+        self.arrays = dict()
+        # averaged data for each spacecraft, start, end and cadence requested
+        self.aggregates = dict()
+        self.start_date = None
+        self.end_date = None
+        self.last_refresh = None
+
+    def refresh(self):
+
+        """
+        Function to download the data for the current data window and read it into memory.
+        :return:
+        """
+
+        # starting a timer to see how long the refresh takes
+        timer_start = timer()
+
+        # the data window ends at the end of the current day in UTC, so that the most recent data is included
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        end_date = today + timedelta(days=1)
+        start_date = end_date - self.window
+
+        # downloading the days that are missing or out of date and reading the data into arrays
+        # the data window folders from earlier days are removed once their files are linked into today's
+        dscovr.dscovr_obs_download(start_date, end_date, self.directory, planned=True, keep_windows=1)
+        sta.stereoa_obs_download(start_date, end_date, self.directory, planned=True, keep_windows=1)
+        arrays = {'dscovr': dscovr.dscovr_obs_read(start_date, self.directory),
+                  'stereo-a': sta.stereoa_obs_read(start_date, self.directory)}
+
+        # replacing the data in memory all at once, and removing the averages of the old data
+        with self.lock:
+            self.arrays = arrays
+            self.aggregates = dict()
+            self.start_date = start_date
+            self.end_date = end_date
+            self.last_refresh = datetime.now()
+
+        # stopping the timer and printing out the time it took for the refresh
+        timer_end = timer()
+        print(timer_end - timer_start, 'seconds to refresh the observations.')
+
+    def refresh_loop(self, interval):
+
+        """
+        Function to refresh the data repeatedly with a given gap between. If a refresh fails, the data already in
+        memory is kept until the next one.
+        :param interval: gap between the refreshes, timedelta object
+        :return:
+        """
+
+        while True:
+            try:
+                self.refresh()
+            except Exception as error:
+                print('Refreshing the observations failed:', error)
+            time.sleep(interval.total_seconds())
+
+    def observations(self, spacecraft, start=None, end=None, cadence=timedelta(hours=1)):
+
+        """
+        Function to return the data for a spacecraft averaged onto dates between a start and end date.
+        :param spacecraft: name of the spacecraft, one of SPACECRAFT
+        :param start: first date of the data, datetime object. Defaults to the start of the data window
+        :param end: last date of the data, datetime object. Defaults to the end of the data window
+        :param cadence: gap between the dates, timedelta object
+        :return: list of dates and the averaged solar wind speed at each date
+        """
+
+        if spacecraft not in SPACECRAFT:
+            raise KeyError('No observations for ' + spacecraft + '.')
+
+        with self.lock:
+            if self.last_refresh is None:
+                raise LookupError('Observations have not been downloaded yet.')
+            start = self.start_date if start is None else start
+            end = self.end_date if end is None else end
+            key = (spacecraft, start, end, cadence)
+            if key in self.aggregates:
+                return self.aggregates[key]
+            # keeping the data being averaged, to check it has not been refreshed before the average is kept
+            all_arrays = self.arrays
+            arrays = all_arrays.get(spacecraft)
+
+        # limiting the number of dates, so that one request cannot use up all the memory
+        if (end - start) / cadence > self.max_dates:
+            raise ValueError('More than ' + str(self.max_dates) + ' dates requested.')
+
+        # averaging the data outside the lock, so other requests are not held up
+        dates = f.date_list(start, end, cadence)
+        if arrays is None:
+            # STEREO-B is no longer operational, so it has no data
+            solar_wind_speed = np.full(len(dates), np.nan)
+        else:
+            solar_wind_speed = f.hourly_average(arrays[0], arrays[1], dates, window=cadence)
+
+        # keeping the averaged data, unless the data has been refreshed while it was averaged
+        # removing the oldest averages if there are too many, or they have too many dates between them
+        with self.lock:
+            if self.arrays is not all_arrays or len(dates) > self.max_cached_dates:
+                return dates, solar_wind_speed
+            self.aggregates[key] = (dates, solar_wind_speed)
+            cached_dates = sum(len(aggregate[0]) for aggregate in self.aggregates.values())
+            while len(self.aggregates) > self.max_aggregates or cached_dates > self.max_cached_dates:
+                cached_dates -= len(self.aggregates.pop(next(iter(self.aggregates)))[0])
+
+        return dates, solar_wind_speed
+
+
+def obs_response(dates, solar_wind_speed, output_format):
+
+    """
+    Function to turn the averaged data into the body of a response.
+    :param dates: dates of the data, list of datetime objects
+    :param solar_wind_speed: solar wind speed at each date
+    :param output_format: one of FORMATS
+    :return: response body, bytes
+    """
+
+    table = f.bravda_table(dates, solar_wind_speed)
+
+    # the same columns as the binary format, as little-endian 64 bit floats
+    if output_format == 'binary':
+        return table.astype('<f8').tobytes()
+
+    text = io.StringIO()
+    if output_format == 'csv':
+        text.write('Date,Year,DOY,Hour,Solar_wind_speed\n')
+        for date, row in zip(dates, table):
+            text.write('%s,%d,%d,%d,%.1f\n' % (date.isoformat(), row[0], row[1], row[2], row[3]))
+    else:
+        # the same format as the observation files saved for BRaVDA
+        np.savetxt(text, table, fmt=['%4.0d', '%4.0d', '%3.0d', '%6.0f'])
+
+    return text.getvalue().encode()
+
+
+def utc_date(text):
+
+    """
+    Function to read a date from an ISO string, changing dates with a time zone into UTC without a time zone, to match
+    the dates of the data.
+    :param text: date, str
+    :return: date, datetime object
+    """
+
+    date = datetime.fromisoformat(text)
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return date
+
+
+class ObsRequestHandler(BaseHTTPRequestHandler):
+
+    """
+    Class to answer requests of the form GET /obs/{spacecraft}?start=&end=&cadence=&format= from the observations in
+    memory. The start and end are ISO dates, the cadence is in minutes and the format is one of FORMATS. Only the csv
+    format has the minutes of each date, so the other formats need a cadence of whole hours.
+    """
+
+    cache = None
+
+    def do_GET(self):
+
+        url = urlsplit(self.path)
+        match = re.fullmatch(r'/obs/([\w-]+)', url.path)
+        if match is None:
+            self.send_error(404, 'Unknown path. Use /obs/{spacecraft}.')
+            return
+
+        # reading the options from the query, using the defaults if they are not given
+        query = parse_qs(url.query)
+        try:
+            start = utc_date(query['start'][0]) if 'start' in query else None
+            end = utc_date(query['end'][0]) if 'end' in query else None
+            cadence = timedelta(minutes=int(query.get('cadence', ['60'])[0]))
+            output_format = query.get('format', ['bravda'])[0]
+            if cadence <= timedelta(0) or output_format not in FORMATS:
+                raise ValueError
+        except (ValueError, OverflowError):
+            self.send_error(400, 'Invalid start, end, cadence or format.')
+            return
+
+        # the BRaVDA and binary formats only have the hour of each date, so the cadence needs to be whole hours
+        if output_format != 'csv' and cadence % timedelta(hours=1) != timedelta(0):
+            self.send_error(400, 'The ' + output_format + ' format needs a cadence of whole hours. Use csv instead.')
+            return
+
+        try:
+            dates, solar_wind_speed = self.cache.observations(match.group(1).lower(), start, end, cadence)
+        except KeyError:
+            self.send_error(404, 'Unknown spacecraft. Use one of ' + ', '.join(SPACECRAFT) + '.')
+            return
+        except LookupError:
+            self.send_error(503, 'Observations have not been downloaded yet.')
+            return
+        except ValueError:
+            self.send_error(400, 'Too many dates requested. Use a shorter window or a longer cadence.')
+            return
+        except OverflowError:
+            self.send_error(400, 'The dates requested are out of range. Use a shorter cadence.')
+            return
+
+        body = obs_response(dates, solar_wind_speed, output_format)
+        self.send_response(200)
+        self.send_header('Content-Type', FORMATS[output_format])
+        self.send_header('Content-Length', str(len(body)))
+        if output_format == 'binary':
+            self.send_header('X-Array-Shape', str(len(dates)) + ',4')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(directory, host='127.0.0.1', port=8000, window=timedelta(days=5), refresh_interval=timedelta(minutes=30)):
+
+    """
+    Function to run a local HTTP server that returns the real time observations from memory, refreshing them in the
+    background.
+    :param directory: location where the data will be downloaded to
+    :param host: address the server listens on
+    :param port: port the server listens on
+    :param window: length of the data window kept in memory, timedelta object
+    :param refresh_interval: gap between downloading the data again, timedelta object
+    :return:
+    """
+
+    cache = ObsCache(directory, window)
+
+    # refreshing the data in a background thread, which stops when the server stops
+    refresh_thread = threading.Thread(target=cache.refresh_loop, args=(refresh_interval,), daemon=True)
+    refresh_thread.start()
+
+    # each server has its own handler class, so that it uses its own data
+    handler = type('Handler', (ObsRequestHandler,), {'cache': cache})
+    server = ThreadingHTTPServer((host, port), handler)
+    print('Serving observations on http://' + host + ':' + str(port) + '/obs/{spacecraft}')
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -0,0 +1,117 @@
+__author__ = 'Harriet Turner'
+__email__ = 'h.turner3@pgr.reading.ac.uk'
+
+import os
+import cProfile
+import pstats
+import tracemalloc
+import contextlib
+from contextlib import contextmanager
+from timeit import default_timer as timer
+
+
+# environment variable that turns on profiling, set to the folder the profiles are saved in
+PROFILE_ENV = 'RT_DOWNLOAD_PROFILE'
+
+
+# names of the stages being profiled, so that stages inside other stages are not profiled twice
+_active_stages = list()
+
+
+# frames of the profiling itself, which are left out of the memory reports
+_profiling_filters = [tracemalloc.Filter(False, tracemalloc.__file__),
+                      tracemalloc.Filter(False, contextlib.__file__),
+                      tracemalloc.Filter(False, __file__)]
+
+
+def start_profile(profile=None, run_name='run'):
+
+    """
+    Function to find the folder the profiles of a run are saved in, from the given folder or the environment variable,
+    and to start a new summary of the functions taking the most time. Each run is saved in its own folder, so that
+    running one function after another, eg. for DSCOVR and then STEREO-A, keeps the profiles of both.
+    :param profile: folder to save the profiles in, str. If None, the RT_DOWNLOAD_PROFILE environment variable is used
+    :param run_name: name of the folder inside the profile folder for this run, str
+    :return: folder, str, or None if profiling is turned off
+    """
+
+    if profile is None:
+        profile = os.environ.get(PROFILE_ENV) or None
+    if profile is None:
+        return None
+
+    # removing the summary from the last time this run was profiled
+    folder = os.path.join(profile, run_name)
+    if os.path.exists(os.path.join(folder, 'summary.txt')):
+        os.remove(os.path.join(folder, 'summary.txt'))
+
+    return folder
+
+
+@contextmanager
+def profile_stage(name, folder, top=15):
+
+    """
+    Context manager to profile a stage of the code with cProfile and tracemalloc. Saves the cProfile stats to
+    {name}.pstats, the time taken, peak memory and the lines whose memory grew the most over the stage to
+    {name}_memory.txt and adds a line for each of the functions taking the most time to summary.txt. Does nothing if the folder is None, or inside another stage,
+    where the time is already included in the profile of the outer stage.
+    :param name: name of the stage, used for the file names
+    :param folder: folder to save the profiles in, str or None
+    :param top: number of functions and allocations listed, int
+    :return:
+    """
+
+    if folder is None or len(_active_stages) > 0:
+        yield
+        return
+
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    # starting the memory tracing, unless it is already on, in which case it is left running afterwards
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    elif hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    start_snapshot = tracemalloc.take_snapshot().filter_traces(_profiling_filters)
+
+    # starting the profiler
+    _active_stages.append(name)
+    profiler = cProfile.Profile()
+    timer_start = timer()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        # stopping the profiler and the memory tracing
+        profiler.disable()
+        timer_end = timer()
+        _active_stages.pop()
+        peak = tracemalloc.get_traced_memory()[1]
+        snapshot = tracemalloc.take_snapshot().filter_traces(_profiling_filters)
+        if started_tracing:
+            tracemalloc.stop()
+
+        # saving the stats so they can be opened with pstats or snakeviz
+        profiler.dump_stats(os.path.join(folder, name + '.pstats'))
+
+        # saving the time taken, the peak memory and the lines whose memory grew the most between the start and end
+        # of the stage, which is the memory still held at the end rather than at the peak
+        with open(os.path.join(folder, name + '_memory.txt'), 'w') as file:
+            file.write('Time taken: ' + format(timer_end - timer_start, '.2f') + ' seconds\n')
+            file.write('Peak memory: ' + format(peak / 1e6, '.1f') + ' MB\n')
+            file.write('Largest increases in memory held between the start and end of the stage:\n')
+            for stat in snapshot.compare_to(start_snapshot, 'lineno')[:top]:
+                file.write(str(stat) + '\n')
+
+        # adding a line to the summary for each of the functions that took the most time, leaving out the ones that
+        # took too little time to measure
+        stats = pstats.Stats(profiler).sort_stats('tottime')
+        with open(os.path.join(folder, 'summary.txt'), 'a') as file:
+            for function in stats.fcn_list[:top]:
+                total_time = stats.stats[function][2]
+                if total_time < 0.0005:
+                    break
+                file.write(name + '\t' + format(total_time, '.3f') + ' s\t' + pstats.func_std_string(function) + '\n')
@@ -6,6 +6,8 @@ import cdflib
 from datetime import datetime, timedelta
 import pandas as pd
 from Code import useful_functions as f
+from Code import download_planner as planner
+from Code import profiling
 import numpy as np
 from timeit import default_timer as timer
 
@@ -63,7 +65,7 @@ def stereoa_rt_file_downloader(date, destination):
     parent_directory = 'https://stereo-ssc.nascom.nasa.gov/data/beacon/ahead/plastic/'
     master_link = f.rt_directory_finder(date, parent_directory)
     # listing all the links on the webpage
-    links = f.webpage_links(master_link)
+    links = f.cached_webpage_links(master_link)
     # finding the correct cdf link for the date
     url = cdf_link_date_filter(links, date)
 
@@ -71,13 +73,17 @@ def stereoa_rt_file_downloader(date, destination):
     f.web_scraper(str(master_link + '/' + url), os.path.join(destination, url))
 
 
-def stereoa_obs_download(start_date, end_date, obs_folder):
+def stereoa_obs_download(start_date, end_date, obs_folder, planned=False, keep_windows=None):
 
     """
     Function to download the STEREO-A real time data between two dates. Creates a folder to store the data in.
     :param start_date: start date of the interval to be downloaded
     :param end_date: end date of the interval to be downloaded
     :param obs_folder: where the data will be saved
+    :param planned: whether to keep the files already downloaded and only download the missing or out of date days,
+    newest first, retrying failed days later
+    :param keep_windows: when planned, the number of data window folders to keep, including this one. If None, the
+    older data window folders are all kept
     :return:
     """
 
@@ -93,6 +99,14 @@ def stereoa_obs_download(start_date, end_date, obs_folder):
     else:
         os.mkdir(os.path.join(obs_folder, 'STEREO-A_raw'))
 
+    # downloads the days that are missing or were downloaded before the end of the day, keeping the rest of the folder
+    # there is only one data product, so it is ignored by the downloader
+    if planned:
+        planner.run_plan('STEREO-A', dates, os.path.join(obs_folder, 'STEREO-A_raw', date_str), obs_folder,
+                         lambda product, date, destination: stereoa_rt_file_downloader(date, destination),
+                         keep_windows=keep_windows)
+        return
+
     # checks if the folder already exists
     # if it does, then the contents are removed so that the new data can be downloaded into the folder
     # if it doesn't exists, then it is created
@@ -160,61 +174,146 @@ def stereoa_cdf_reader(file):
     return data
 
 
-def stereoa_obs_format(start_date, end_date, folder):
+def stereoa_cdf_length(file):
 
     """
-    Function to combine the STEREO-A real time data into one file in the format that is accepted by BRaVDA.
-    :param start_date: start date of the data window
-    :param end_date: end date of the data window
-    :param folder: where the folder containing the data is located and where the file will be saved
+    Function to find the number of data points in a STEREO-A cdf file from the file metadata, without reading the data.
+    :param file: filepath to the cdf file
+    :return: number of data points, int
+    """
+
+    # the records are numbered from zero, so the number of data points is one more than the last record
+    cdf = cdflib.CDF(file)
+    return cdf.varinq('Bulk_Speed')['Last_Rec'] + 1
+
+
+def stereoa_cdf_read_into(file, times, speeds):
+
+    """
+    Function to read the cdf file given straight into arrays that have already been created, rather than into a pandas
+    dataframe.
+    :param file: filepath to the cdf file
+    :param times: array to fill with the times, in milliseconds since 1970-01-01 00:00:00
+    :param speeds: array to fill with the solar wind speeds, with unphysical values as NaNs
     :return:
     """
 
+    # making sure that the data file is the correct type
+    if '.cdf' not in file:
+        raise ValueError('File is of the wrong type. It must be a .cdf file.')
+
+    # reading the cdf file and converting the epoch times to milliseconds since 1970 all at once
+    cdf = cdflib.CDF(file)
+    times[:] = np.round(cdflib.cdfepoch.unixtime(cdf.varget('Epoch1'), to_np=True) * 1000)
+    speeds[:] = cdf.varget('Bulk_Speed')
+
+    # removing the unphysical values and changing them to NaNs, one file at a time so the temporary arrays stay small
+    speeds[speeds < 0] = np.nan
+
+
+def stereoa_obs_read(start_date, folder, memory_map=False):
+
+    """
+    Function to read all the downloaded STEREO-A observations for a data window into single arrays. The arrays are
+    created at the full size from the file metadata and filled file by file.
+    :param start_date: start date of the data window
+    :param folder: where the folder containing the data is located
+    :param memory_map: whether the arrays are memory-mapped to temporary files rather than held in memory, bool
+    :return: dates as a numpy datetime64 array and the solar wind speeds, with unphysical values as NaNs
+    """
+
     # taking the date and finding the folder
-    # turning the date into a string to search the folder
-    folder_date = f.date_string(start_date)
-    data_folder = os.path.join(folder, 'STEREO-A_raw', folder_date)
+    data_folder = os.path.join(folder, 'STEREO-A_raw', f.date_string(start_date))
 
     # listing all the files in the folder
     try:
-        files = os.listdir(data_folder)
+        files = [file for file in os.listdir(data_folder) if file.endswith('.cdf')]
     except:
         raise ValueError('Data does not exist for this date.')
+    # the file names end with the date, so sorting them puts the data in chronological order
+    files.sort()
 
-    # empty lists to append the data to
-    dates = list()
-    solar_wind_speed = list()
+    # finding the length of each file to create arrays large enough for all the data
+    paths = [os.path.join(data_folder, file) for file in files]
+    lengths = [stereoa_cdf_length(path) for path in paths]
+    times = f.preallocate(sum(lengths), 'int64', memory_map)
+    solar_wind_speed = f.preallocate(sum(lengths), 'float64', memory_map)
 
-    # looping through the files to extract the data
-    for file in files:
-        path = os.path.join(data_folder, file)
-        data = stereoa_cdf_reader(path)
-        for i in range(0, len(data)):
-            dates.append(data['Date'].iloc[i])
-            solar_wind_speed.append(data['Solar_wind_speed'].iloc[i])
+    # reading each file into its section of the arrays
+    position = 0
+    for path, length in zip(paths, lengths):
+        stereoa_cdf_read_into(path, times[position:position + length], solar_wind_speed[position:position + length])
+        position += length
 
-    # dataframe containing all the data
-    full_df = pd.DataFrame()
-    full_df['Date'] = dates
-    full_df['Solar_wind_speed'] = solar_wind_speed
+    # the times are in milliseconds since 1970, so they can be viewed as dates without copying them
+    return times.view('datetime64[ms]'), solar_wind_speed
 
-    # removing the unphysical values and changing them to NaNs
-    full_df['Solar_wind_speed'].loc[full_df['Solar_wind_speed'] < 0] = np.nan
+
+def stereoa_obs_format(start_date, end_date, folder, memory_map=False):
+
+    """
+    Function to combine the STEREO-A real time data into one file in the format that is accepted by BRaVDA.
+    :param start_date: start date of the data window
+    :param end_date: end date of the data window
+    :param folder: where the folder containing the data is located and where the file will be saved
+    :param memory_map: whether to read the data into memory-mapped arrays and average them without copying, for
+    large data windows, bool
+    :return:
+    """
 
     # list of hourly dates
     hourly_dates = f.date_list(start_date, end_date, timedelta(hours=1))
-    # list for the hourly solar wind speed
-    hourly_solar_wind_speed = []
+
+    if memory_map:
+        # reads the data straight into memory-mapped arrays and averages them to one hour resolution
+        dates, solar_wind_speed = stereoa_obs_read(start_date, folder, memory_map=True)
+        hourly_solar_wind_speed = f.hourly_average(dates, solar_wind_speed, hourly_dates)
+    else:
+        # taking the date and finding the folder
+        # turning the date into a string to search the folder
+        folder_date = f.date_string(start_date)
+        data_folder = os.path.join(folder, 'STEREO-A_raw', folder_date)
+
+        # listing all the files in the folder
+        try:
+            files = [file for file in os.listdir(data_folder) if file.endswith('.cdf')]
+        except:
+            raise ValueError('Data does not exist for this date.')
+
+        # empty lists to append the data to
+        dates = list()
+        solar_wind_speed = list()
+
+        # looping through the files to extract the data
+        for file in files:
+            path = os.path.join(data_folder, file)
+            data = stereoa_cdf_reader(path)
+            for i in range(0, len(data)):
+                dates.append(data['Date'].iloc[i])
+                solar_wind_speed.append(data['Solar_wind_speed'].iloc[i])
+
+        # dataframe containing all the data
+        full_df = pd.DataFrame()
+        full_df['Date'] = dates
+        full_df['Solar_wind_speed'] = solar_wind_speed
+
+        # removing the unphysical values and changing them to NaNs
+        full_df['Solar_wind_speed'].loc[full_df['Solar_wind_speed'] < 0] = np.nan
+
+        # list for the hourly solar wind speed
+        hourly_solar_wind_speed = []
+
+        # averaging the data to an hourly resolution
+        for i in range(0, len(hourly_dates)):
+            data_req = full_df.loc[(full_df['Date'] >= hourly_dates[i] - timedelta(minutes=30)) &
+                                   (full_df['Date'] < hourly_dates[i] + timedelta(minutes=30))]
+            hourly_solar_wind_speed.append(data_req['Solar_wind_speed'].mean())
+
     # lists for the year, day of year and hour
     years = list()
     doys = list()
     hours = list()
-
-    # averaging the data to an hourly resolution
     for i in range(0, len(hourly_dates)):
-        data_req = full_df.loc[(full_df['Date'] >= hourly_dates[i] - timedelta(minutes=30)) &
-                               (full_df['Date'] < hourly_dates[i] + timedelta(minutes=30))]
-        hourly_solar_wind_speed.append(data_req['Solar_wind_speed'].mean())
         years.append(f.date_to_doy(hourly_dates[i])[0])
         doys.append(f.date_to_doy(hourly_dates[i])[1])
         hours.append(f.date_to_doy(hourly_dates[i])[2])
@@ -245,23 +344,31 @@ def stereoa_obs_format(start_date, end_date, folder):
                fmt=['%4.0d', '%4.0d', '%3.0d', '%6.0f'])
 
 
-def stereoa_real_time_obs(start_date, end_date, directory):
+def stereoa_real_time_obs(start_date, end_date, directory, memory_map=False, planned=False, profile=None):
 
     """
     Function to pull together the downloading of the STEREO-A data and formatting it to be used in BRaVDA.
     :param start_date: start date of the data to be downloaded
     :param end_date: end date of the data to be downloaded
     :param directory: where the data will be saved
+    :param memory_map: whether to format the data using memory-mapped arrays, for large data windows
+    :param planned: whether to only download the days that are missing or out of date, newest first
+    :param profile: folder to save profiles of each stage in. If None, profiling is only turned on by the
+    RT_DOWNLOAD_PROFILE environment variable
     :return:
     """
 
     # starting a timer to see how long the code takes
     timer_start = timer()
+    # finding where to save the profiles, if profiling is turned on
+    profile = profiling.start_profile(profile, 'stereoa')
 
     # downloading the STEREO-A observations
-    stereoa_obs_download(start_date, end_date, directory)
+    with profiling.profile_stage('stereoa_download', profile):
+        stereoa_obs_download(start_date, end_date, directory, planned)
     # formatting the observations
-    stereoa_obs_format(start_date, end_date, directory)
+    with profiling.profile_stage('stereoa_format', profile):
+        stereoa_obs_format(start_date, end_date, directory, memory_map)
 
     # stopping the timer and printing out the time it took for the code to run
     timer_end = timer()
@@ -2,6 +2,9 @@ __author__ = 'Harriet Turner'
 __email__ = 'h.turner3@pgr.reading.ac.uk'
 
 import requests
+import tempfile
+import threading
+import numpy as np
 from bs4 import BeautifulSoup as bs
 from datetime import datetime, timedelta
 from astropy.time import Time
@@ -64,6 +67,82 @@ def flatten_list(list_to_flatten):
     return [item for sublist in list_to_flatten for item in sublist]
 
 
+def preallocate(length, dtype, memory_map=False):
+
+    """
+    Function to create an empty array to read data straight into. If memory_map is True, the array is backed by a
+    temporary file on disk rather than held in memory, so that large archives can be read without running out of RAM.
+    :param length: number of elements in the array, int
+    :param dtype: data type of the array, eg. 'float64'
+    :param memory_map: whether the array is memory-mapped to a temporary file, bool
+    :return: empty array
+    """
+
+    # memory-maps of zero length are not allowed, so an empty in-memory array is returned instead
+    if not memory_map or length == 0:
+        return np.empty(length, dtype=dtype)
+
+    # the temporary file is removed when it is closed, which happens when the array is no longer used
+    return np.memmap(tempfile.TemporaryFile(), dtype=dtype, mode='w+', shape=(length,))
+
+
+def hourly_average(times, values, hourly_dates, window=timedelta(hours=1), chunk=1000000):
+
+    """
+    Function to average data onto a list of dates, using a window centred on each date. This does the same as
+    selecting the data for each date with pandas .loc, but works on the data arrays directly, so they are not copied.
+    If the data arrays are memory-mapped, the running totals used for the averages are memory-mapped too.
+    :param times: dates of the data, numpy datetime64 array
+    :param values: data to be averaged, numpy array. NaNs are ignored
+    :param hourly_dates: dates to average the data onto, list of datetime objects
+    :param window: width of the averaging window centred on each date, timedelta object
+    :param chunk: number of data points worked on at once, which limits the size of the temporary arrays, int
+    :return: averaged data, numpy array. NaN where there is no data in the window
+    """
+
+    # the data needs to be in chronological order to search it, so it is only sorted if it is not already
+    # checked a chunk at a time, overlapping by one point, so that no full length temporary arrays are made
+    for position in range(0, max(len(times) - 1, 0), chunk):
+        block = times[position:position + chunk + 1]
+        if np.any(block[1:] < block[:-1]):
+            order = np.argsort(times, kind='stable')
+            times = times[order]
+            values = values[order]
+            break
+
+    # start and end of the averaging window around each date, in the same units as the data dates
+    grid = np.array(hourly_dates, dtype='datetime64[ms]')
+    half_window = np.timedelta64(window) / 2
+    starts = (grid - half_window).astype(times.dtype)
+    ends = (grid + half_window).astype(times.dtype)
+
+    # finding the positions of the start and end of each window in the data
+    lo = np.searchsorted(times, starts, side='left')
+    hi = np.searchsorted(times, ends, side='left')
+
+    # running totals of the data and the number of data points, ignoring NaNs, so the sum over any window is the
+    # difference between the totals at its end and start
+    # the totals are filled a chunk at a time, carrying on from the end of the previous chunk
+    memory_map = isinstance(values, np.memmap)
+    sums = preallocate(len(values) + 1, 'float64', memory_map)
+    counts = preallocate(len(values) + 1, 'int64', memory_map)
+    sums[0] = 0.0
+    counts[0] = 0
+    for position in range(0, len(values), chunk):
+        block = values[position:position + chunk]
+        valid = ~np.isnan(block)
+        block_sums = sums[position + 1:position + 1 + len(block)]
+        block_counts = counts[position + 1:position + 1 + len(block)]
+        np.cumsum(np.where(valid, block, 0.0), out=block_sums)
+        np.cumsum(valid, out=block_counts)
+        block_sums += sums[position]
+        block_counts += counts[position]
+
+    # windows with no data are 0/0, which gives a NaN in the same way as the mean of an empty pandas column
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (sums[hi] - sums[lo]) / (counts[hi] - counts[lo])
+
+
 def web_scraper(url, filename):
 
     """
@@ -99,6 +178,33 @@ def webpage_links(url):
     return links
 
 
+# links found on each webpage, with the time they were found, so that the same page is not requested repeatedly
+_link_cache = dict()
+_link_cache_lock = threading.Lock()
+
+
+def cached_webpage_links(url, max_age=timedelta(minutes=10)):
+
+    """
+    Function to return all the links from a webpage, reusing the links found previously if they are recent enough.
+    :param url: link to the webpage
+    :param max_age: how long the links from a webpage are reused for before it is requested again, timedelta object
+    :return: list of links from the webpage
+    """
+
+    # returns the stored links if the page was requested recently
+    with _link_cache_lock:
+        if url in _link_cache and datetime.now() - _link_cache[url][0] < max_age:
+            return _link_cache[url][1]
+
+    # otherwise requests the page again and stores the links
+    links = webpage_links(url)
+    with _link_cache_lock:
+        _link_cache[url] = (datetime.now(), links)
+
+    return links
+
+
 def rt_directory_finder(date, master_page):
 
     """
@@ -136,6 +242,29 @@ def date_to_doy(date):
     return year, doy, hour
 
 
+def bravda_table(hourly_dates, solar_wind_speed):
+
+    """
+    Function to put hourly data into the columns used in the BRaVDA observation files.
+    :param hourly_dates: dates of the data, list of datetime objects
+    :param solar_wind_speed: solar wind speed at each date
+    :return: array with columns of year, DOY, hour and solar wind speed
+    """
+
+    # splitting all the dates into year, day of year and hour at once, in the same way as date_to_doy
+    dates = np.array(hourly_dates, dtype='datetime64[s]')
+    days = dates.astype('datetime64[D]')
+    years = days.astype('datetime64[Y]')
+
+    table = np.empty((len(hourly_dates), 4))
+    table[:, 0] = years.astype(int) + 1970
+    table[:, 1] = (days - years).astype(int) + 1
+    table[:, 2] = (dates - days).astype('timedelta64[h]').astype(int)
+    table[:, 3] = solar_wind_speed
+
+    return table
+
+
 def date_string(date):
 
     """
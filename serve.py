@@ -0,0 +1,12 @@
+__author__ = 'Harriet Turner'
+__email__ = 'h.turner3@pgr.reading.ac.uk'
+
+from Data_download import obs_service
+from datetime import timedelta
+
+# Running a local server that keeps the last five days of observations in memory, downloading them again every
+# 30 minutes. The observations are requested from http://127.0.0.1:8000/obs/{spacecraft}?start=&end=&cadence=&format=
+
+obs_service.serve('D:\\PhD\\Real_time_data_download\\Data',
+                  window=timedelta(days=5),
+                  refresh_interval=timedelta(minutes=30))